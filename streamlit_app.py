@@ -1,10 +1,14 @@
 import streamlit as st
 import google.generativeai as genai
-import pandas as pd
+import openpyxl
 import json
+import io
 import os
+import hashlib
+from collections import deque
 from datetime import datetime
 import re
+import orjson
 
 # Configure page
 st.set_page_config(
@@ -13,49 +17,140 @@ st.set_page_config(
     layout="wide"
 )
 
+# Classified words are stored column-wise: one list per field
+CLASSIFIED_FIELDS = ('word', 'classification', 'department', 'timestamp')
+
+def new_classified_columns():
+    """Create an empty column store for classified words"""
+    return {field: [] for field in CLASSIFIED_FIELDS}
+
+def classified_records(columns):
+    """Convert the column store back into one dict per classified word"""
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
 # Initialize session state
-if 'conversation_stage' not in st.session_state:
-    st.session_state.conversation_stage = 'initial'
-if 'user_department' not in st.session_state:
-    st.session_state.user_department = ''
-if 'collected_words' not in st.session_state:
-    st.session_state.collected_words = []
-if 'pending_classification' not in st.session_state:
-    st.session_state.pending_classification = []
-if 'classified_words' not in st.session_state:
-    st.session_state.classified_words = []
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+# Mutable defaults come from factories so each session gets its own objects
+SESSION_DEFAULTS = (
+    ('conversation_stage', lambda: 'initial'),
+    ('user_department', str),
+    ('collected_words', list),
+    ('pending_classification', deque),
+    ('classified_words', new_classified_columns),
+    ('classified_set', set),
+    ('chat_history', list),
+    ('ready_for_download', bool),
+)
+for key, default_factory in SESSION_DEFAULTS:
+    if key not in st.session_state:
+        st.session_state[key] = default_factory()
 
 # Data storage functions
-def save_to_excel(data):
-    """Save classified words to Excel file"""
+def save_to_excel(columns):
+    """Serialize classified word columns to Excel file bytes"""
     try:
-        df = pd.DataFrame(data)
-        filename = f"sirar_dmo_keywords_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        df.to_excel(filename, index=False)
-        return filename
+        # Write-only workbook streams rows straight from the columns
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet("keywords")
+        ws.append(list(columns))
+        for row in zip(*columns.values()):
+            ws.append(list(row))
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        return buffer.getvalue()
     except Exception as e:
         st.error(f"Error saving to Excel: {str(e)}")
         return None
 
 def save_to_json(data):
-    """Save classified words to JSON file"""
+    """Serialize classified words to JSON file bytes"""
     try:
-        filename = f"sirar_dmo_keywords_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        return filename
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
     except Exception as e:
         st.error(f"Error saving to JSON: {str(e)}")
         return None
 
+# Classified words are also kept on disk per department so they survive server restarts
+DATA_DIR = "data"
+
+def department_store_path(department):
+    """Path of the saved classified words for a department"""
+    # Hash the normalized name so every department, Arabic included, gets its own file
+    digest = hashlib.sha1(department.strip().casefold().encode('utf-8')).hexdigest()
+    return os.path.join(DATA_DIR, f"{digest}.jsonl")
+
+def load_classified_words(department):
+    """Load previously saved classified word columns for a department"""
+    columns = new_classified_columns()
+    try:
+        # Later records for the same word win, so each word is restored once
+        latest = {}
+        with open(department_store_path(department), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    latest[record['word'].lower()] = record
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # A crash mid-append can leave a partial last line
+                    continue
+        for record in latest.values():
+            for field in CLASSIFIED_FIELDS:
+                columns[field].append(record.get(field))
+    except FileNotFoundError:
+        pass
+    return columns
+
+def persist_classified_word(department, record):
+    """Append one classified word to the department's saved store"""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    # One small append per word: sessions in the same department add to the
+    # store instead of overwriting each other, and each write is O(1)
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+    with open(department_store_path(department), 'ab+') as f:
+        # Start a fresh line if a crash left the last record unterminated
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+
+# Pattern and stop words used by extract_words_from_text
+WORD_PATTERN = re.compile(r'\b[a-zA-Z]{3,}\b')
+COMMON_WORDS = frozenset({'and', 'the', 'for', 'are', 'but', 'not', 'you', 'all', 'can', 'had', 'her', 'was', 'one', 'our', 'out', 'day', 'get', 'has', 'him', 'his', 'how', 'its', 'may', 'new', 'now', 'old', 'see', 'two', 'way', 'who', 'boy', 'did', 'man', 'say', 'she', 'use', 'what', 'when', 'where', 'will', 'with'})
+
 def extract_words_from_text(text):
     """Extract meaningful words from user input"""
     # Remove common words and extract meaningful terms
-    words = re.findall(r'\b[a-zA-Z]{3,}\b', text.lower())
-    common_words = {'and', 'the', 'for', 'are', 'but', 'not', 'you', 'all', 'can', 'had', 'her', 'was', 'one', 'our', 'out', 'day', 'get', 'has', 'him', 'his', 'how', 'its', 'may', 'new', 'now', 'old', 'see', 'two', 'way', 'who', 'boy', 'did', 'man', 'say', 'she', 'use', 'what', 'when', 'where', 'will', 'with'}
-    return [word for word in words if word not in common_words]
+    return [word for word in WORD_PATTERN.findall(text.lower()) if word not in COMMON_WORDS]
+
+# Keywords used to detect off-topic questions
+OFF_TOPIC_KEYWORDS = frozenset({
+    'weather', 'news', 'joke', 'story', 'recipe', 'music', 'movie', 'game', 
+    'sports', 'politics', 'religion', 'health', 'medical', 'code', 'programming',
+    'math', 'calculate', 'translate', 'how to', 'what is', 'who is', 'when is',
+    'where is', 'why is', 'help me', 'can you', 'tell me about', 'explain'
+})
+
+# Keywords showing the input is still about work/keywords
+WORK_KEYWORDS = frozenset({'work', 'job', 'office', 'document', 'word', 'term', 'memo', 'report', 'department'})
+
+# Inputs shorter than the shortest off-topic keyword can never be off-topic
+MIN_OFF_TOPIC_LENGTH = min(len(keyword) for keyword in OFF_TOPIC_KEYWORDS)
+
+# Each keyword list compiles to one alternation, scanned by the C regex engine
+OFF_TOPIC_PATTERN = re.compile('|'.join(map(re.escape, sorted(OFF_TOPIC_KEYWORDS))))
+WORK_PATTERN = re.compile('|'.join(map(re.escape, sorted(WORK_KEYWORDS))))
+
+def is_off_topic(user_input):
+    """Check if user input is off-topic"""
+    if len(user_input) < MIN_OFF_TOPIC_LENGTH:
+        return False
+    
+    # Most messages have no off-topic keyword, so that scan runs first and the
+    # work-context scan only runs when it could change the answer
+    input_lower = user_input.lower()
+    if not OFF_TOPIC_PATTERN.search(input_lower):
+        return False
+    return not WORK_PATTERN.search(input_lower)
 
 # Prompt Template for Gemini
 SYSTEM_PROMPT = """
@@ -81,18 +176,31 @@ ALLOWED TOPICS ONLY:
 Stay focused on your mission: collecting and classifying workplace keywords.
 """
 
+# Fixed head of every prompt, built once instead of per turn
+SYSTEM_PROMPT_PREFIX = SYSTEM_PROMPT + "\n\nContext: "
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def generate_cached_response(prompt, api_key, _model):
+    """Call Gemini once per distinct prompt and API key; the model is left out of the cache key"""
+    # The cache is process-wide, so the key keeps one user's paid answers from reaching another
+    return _model.generate_content(prompt).text
+
 def get_bot_response(user_input, context=""):
     """Generate bot response using Gemini with restricted prompt"""
     if not model:
         return "Please configure your API key first."
     
     try:
-        prompt = f"{SYSTEM_PROMPT}\n\nContext: {context}\nUser: {user_input}\nBot:"
-        response = model.generate_content(prompt)
-        return response.text
+        prompt = "".join((SYSTEM_PROMPT_PREFIX, context, "\nUser: ", user_input, "\nBot:"))
+        return generate_cached_response(prompt, api_key, model)
     except Exception as e:
         return f"Error generating response: {str(e)}"
 
+@st.cache_resource(show_spinner=False)
+def get_model(api_key):
+    """Build the model once per API key; the key itself is set by genai.configure"""
+    return genai.GenerativeModel('gemini-pro')
+
 # Sidebar configuration
 st.sidebar.title("🤖 Sirar-DMO-Chatbot")
 st.sidebar.markdown("### Configuration")
@@ -105,8 +213,10 @@ api_key = st.sidebar.text_input("Enter your Gemini API Key", type="password")
 
 if api_key:
     try:
+        # configure sets process-wide state, so it runs on every rerun rather than
+        # only the first time a key is cached; otherwise another session's key wins
         genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
+        model = get_model(api_key)
         st.sidebar.success("✅ API Key configured successfully!")
     except Exception as e:
         st.sidebar.error(f"❌ Error configuring API: {str(e)}")
@@ -126,47 +236,19 @@ st.markdown("### Document Management Organization - Keyword Collector")
 # Important notice about chatbot restrictions
 st.warning("⚠️ **Important**: This chatbot is specialized for collecting and classifying workplace keywords only. It will not respond to general questions, requests for information, or off-topic conversations.")
 
-# Display current session info
-if st.session_state.user_department:
-    st.info(f"👤 Current Department: {st.session_state.user_department}")
-
-# Chat interface
-st.markdown("### 💬 Chat Interface")
+# Initial greeting
+if not st.session_state.chat_history and model:
+    initial_message = "👋 Hello! I'm Sirar-DMO-Chatbot, your specialized Document Management Organization assistant. \n\n⚠️ **Please note**: I can ONLY help with collecting and classifying workplace keywords. I cannot answer general questions or provide other assistance.\n\nTo get started: What department do you work in? (e.g., HR, Finance, IT, Marketing, etc.)"
+    st.session_state.chat_history.append({"role": "assistant", "content": initial_message})
 
-# Display chat history
-for message in st.session_state.chat_history:
-    if message['role'] == 'assistant':
-        with st.chat_message("assistant"):
-            st.write(message['content'])
-    else:
-        with st.chat_message("user"):
+def render_chat_history(messages):
+    """Display chat messages"""
+    for message in messages:
+        with st.chat_message(message['role']):
             st.write(message['content'])
 
-# User input
-user_input = st.chat_input("Type your message here...")
-
-def is_off_topic(user_input):
-    """Check if user input is off-topic"""
-    off_topic_keywords = [
-        'weather', 'news', 'joke', 'story', 'recipe', 'music', 'movie', 'game', 
-        'sports', 'politics', 'religion', 'health', 'medical', 'code', 'programming',
-        'math', 'calculate', 'translate', 'how to', 'what is', 'who is', 'when is',
-        'where is', 'why is', 'help me', 'can you', 'tell me about', 'explain'
-    ]
-    
-    # Check if input contains off-topic keywords and isn't about work/keywords
-    work_keywords = ['work', 'job', 'office', 'document', 'word', 'term', 'memo', 'report', 'department']
-    
-    input_lower = user_input.lower()
-    has_off_topic = any(keyword in input_lower for keyword in off_topic_keywords)
-    has_work_context = any(keyword in input_lower for keyword in work_keywords)
-    
-    return has_off_topic and not has_work_context
-
-if user_input and model:
-    # Add user message to history
-    st.session_state.chat_history.append({"role": "user", "content": user_input})
-    
+def respond_to(user_input):
+    """Advance the conversation stage and return the bot response"""
     # Check for off-topic questions first
     if is_off_topic(user_input) and st.session_state.conversation_stage != 'initial':
         bot_response = "I'm sorry, I can only help with collecting and classifying workplace keywords for document management. Please tell me about the words you commonly use in your work."
@@ -180,6 +262,17 @@ if user_input and model:
             # Initial greeting and department collection
             st.session_state.user_department = user_input
             bot_response = f"Great! I see you work in {st.session_state.user_department}. As a {st.session_state.user_department} employee, what are some words or terms you often write or use in your work? For example: 'memo', 'report', 'evaluation', 'policy', etc. Please list them separated by commas."
+            
+            # Restore words this department classified in earlier sessions; errors go into
+            # the reply because the rerun after this turn would wipe an st.error element
+            try:
+                st.session_state.classified_words = load_classified_words(user_input)
+            except Exception as e:
+                st.session_state.classified_words = new_classified_columns()
+                bot_response += f"\n\n⚠️ Error loading saved words: {str(e)}"
+            st.session_state.classified_set = {word.lower() for word in st.session_state.classified_words['word']}
+            if st.session_state.classified_set:
+                bot_response += f"\n\n📂 I restored {len(st.session_state.classified_set)} previously classified words for {user_input}; they will be skipped."
             st.session_state.conversation_stage = 'collect_words'
         
     elif st.session_state.conversation_stage == 'collect_words':
@@ -188,13 +281,23 @@ if user_input and model:
         words = [word for word in words if len(word) > 2]  # Filter short words
         
         if words and not is_off_topic(user_input):
-            st.session_state.collected_words.extend(words)
-            st.session_state.pending_classification = words.copy()
-            st.session_state.conversation_stage = 'classify_words'
+            # Drop repeats within this input (first spelling wins), then words already classified,
+            # whether earlier in this session or restored from the department's saved store
+            unique_words = {}
+            for word in words:
+                unique_words.setdefault(word.lower(), word)
+            new_words = [word for key, word in unique_words.items() if key not in st.session_state.classified_set]
             
-            # Start classification process
-            current_word = st.session_state.pending_classification[0]
-            bot_response = f"Thank you! I collected these words: {', '.join(words)}\n\nNow, let's classify them. How would you classify the word '{current_word}'? Please choose:\n\n1. **Internal** - Used within the organization only\n2. **Public** - Can be shared publicly\n3. **Confidential** - Sensitive information\n\nPlease type: Internal, Public, or Confidential"
+            if new_words:
+                st.session_state.collected_words.extend(new_words)
+                st.session_state.pending_classification = deque(new_words)
+                st.session_state.conversation_stage = 'classify_words'
+                
+                # Start classification process
+                current_word = st.session_state.pending_classification[0]
+                bot_response = f"Thank you! I collected these words: {', '.join(new_words)}\n\nNow, let's classify them. How would you classify the word '{current_word}'? Please choose:\n\n1. **Internal** - Used within the organization only\n2. **Public** - Can be shared publicly\n3. **Confidential** - Sensitive information\n\nPlease type: Internal, Public, or Confidential"
+            else:
+                bot_response = "You have already classified all of those words. Please provide new work-related words or terms, separated by commas."
         else:
             bot_response = "Please provide work-related words or terms you commonly use, separated by commas. For example: 'memo, report, evaluation, meeting'"
             
@@ -212,8 +315,17 @@ if user_input and model:
                     'department': st.session_state.user_department,
                     'timestamp': datetime.now().isoformat()
                 }
-                st.session_state.classified_words.append(classified_word)
-                st.session_state.pending_classification.pop(0)
+                for field, value in classified_word.items():
+                    st.session_state.classified_words[field].append(value)
+                st.session_state.classified_set.add(current_word.lower())
+                try:
+                    persist_classified_word(st.session_state.user_department, classified_word)
+                    save_warning = ""
+                except Exception as e:
+                    save_warning = f"\n\n⚠️ Error saving progress: {str(e)}"
+                st.session_state.pending_classification.popleft()
+                # Earlier exports are stale now; rebuild them only when asked again
+                st.session_state.ready_for_download = False
                 
                 if st.session_state.pending_classification:
                     next_word = st.session_state.pending_classification[0]
@@ -221,6 +333,7 @@ if user_input and model:
                 else:
                     bot_response = "🎉 All words classified! Would you like to:\n\n1. Add more words\n2. Download the results\n3. Start over\n\nType 'more', 'download', or 'restart'"
                     st.session_state.conversation_stage = 'final_options'
+                bot_response += save_warning
             else:
                 bot_response = f"Please choose a valid classification for '{current_word}': Internal, Public, or Confidential"
                 
@@ -235,10 +348,9 @@ if user_input and model:
             # Trigger download in the sidebar
             st.session_state.ready_for_download = True
         elif 'restart' in option:
-            # Reset session
-            for key in ['conversation_stage', 'user_department', 'collected_words', 'pending_classification', 'classified_words', 'chat_history']:
-                if key in st.session_state:
-                    del st.session_state[key]
+            # Reset the app's own keys; clearing everything would also drop widget values such as the API key
+            for key, _ in SESSION_DEFAULTS:
+                st.session_state.pop(key, None)
             st.rerun()
         else:
             bot_response = "Please type 'more' to add more words, 'download' to get your results, or 'restart' to begin again."
@@ -246,53 +358,103 @@ if user_input and model:
     else:
         bot_response = "I'm sorry, I can only help with collecting and classifying workplace keywords for document management."
     
-    # Add bot response to history
-    st.session_state.chat_history.append({"role": "assistant", "content": bot_response})
+    return bot_response
+
+def sidebar_snapshot():
+    """Sidebar values that a chat turn can change"""
+    return (
+        len(st.session_state.classified_words['word']),
+        len(st.session_state.pending_classification),
+        st.session_state.ready_for_download
+    )
+
+@st.fragment
+def chat_panel():
+    """Chat history and input; a chat turn reruns only this fragment unless the sidebar changed"""
+    # Display current session info; filled in last so a department set this turn shows at once
+    department_info = st.empty()
+    
+    # Chat interface
+    st.markdown("### 💬 Chat Interface")
+    history = st.container()
+    with history:
+        render_chat_history(st.session_state.chat_history)
+    
+    # User input
+    user_input = st.chat_input("Type your message here...")
+    
+    if user_input and model:
+        sidebar_before = sidebar_snapshot()
+        
+        # Add user message to history
+        st.session_state.chat_history.append({"role": "user", "content": user_input})
+        bot_response = respond_to(user_input)
+        
+        # Add bot response to history
+        st.session_state.chat_history.append({"role": "assistant", "content": bot_response})
+        
+        # The sidebar only needs a full rerun when something it shows changed
+        if sidebar_snapshot() != sidebar_before:
+            st.rerun()
+        
+        # Otherwise draw just the new turn in place; no rerun of any scope is needed,
+        # so this works whether the fragment or the full app is running
+        with history:
+            render_chat_history(st.session_state.chat_history[-2:])
     
-    # Rerun to update chat display
-    st.rerun()
+    if st.session_state.user_department:
+        department_info.info(f"👤 Current Department: {st.session_state.user_department}")
+
+chat_panel()
 
 # Sidebar - Progress and Downloads
 st.sidebar.markdown("### 📊 Progress")
-if st.session_state.classified_words:
-    st.sidebar.markdown(f"**Classified Words:** {len(st.session_state.classified_words)}")
+classified_columns = st.session_state.classified_words
+if classified_columns['word']:
+    st.sidebar.markdown(f"**Classified Words:** {len(classified_columns['word'])}")
     st.sidebar.markdown(f"**Pending:** {len(st.session_state.pending_classification)}")
     
     # Show classified words summary
     if st.sidebar.checkbox("Show classified words"):
-        for word_data in st.session_state.classified_words:
-            st.sidebar.write(f"• {word_data['word']} → {word_data['classification']}")
+        for word, classification in zip(classified_columns['word'], classified_columns['classification']):
+            st.sidebar.write(f"• {word} → {classification}")
 
 # Download section
-if st.session_state.classified_words:
+if classified_columns['word']:
     st.sidebar.markdown("### 📁 Download Results")
     
     if st.sidebar.button("💾 Generate Downloads"):
-        with st.sidebar:
-            with st.spinner("Generating files..."):
-                # Save to Excel
-                excel_file = save_to_excel(st.session_state.classified_words)
-                
-                # Save to JSON
-                json_data = {
-                    'department': st.session_state.user_department,
-                    'collection_date': datetime.now().isoformat(),
-                    'classified_words': st.session_state.classified_words
-                }
-                json_file = save_to_json(json_data)
-                
-                if excel_file and json_file:
-                    st.success("✅ Files generated successfully!")
-                    st.info(f"📊 Excel: {excel_file}")
-                    st.info(f"📄 JSON: {json_file}")
-                else:
-                    st.error("❌ Error generating files")
+        st.session_state.ready_for_download = True
 
-# Initial greeting
-if not st.session_state.chat_history and model:
-    initial_message = "👋 Hello! I'm Sirar-DMO-Chatbot, your specialized Document Management Organization assistant. \n\n⚠️ **Please note**: I can ONLY help with collecting and classifying workplace keywords. I cannot answer general questions or provide other assistance.\n\nTo get started: What department do you work in? (e.g., HR, Finance, IT, Marketing, etc.)"
-    st.session_state.chat_history.append({"role": "assistant", "content": initial_message})
-    st.rerun()
+# Files are built in memory, and only once downloads were requested
+if classified_columns['word'] and st.session_state.ready_for_download:
+    with st.sidebar:
+        # One clock read stamps both files and the collection date
+        generated_at = datetime.now()
+        file_stem = f"sirar_dmo_keywords_{generated_at.strftime('%Y%m%d_%H%M%S')}"
+        
+        excel_file = save_to_excel(classified_columns)
+        json_data = {
+            'department': st.session_state.user_department,
+            'collection_date': generated_at.isoformat(),
+            'classified_words': classified_records(classified_columns)
+        }
+        json_file = save_to_json(json_data)
+
+        if excel_file:
+            st.download_button(
+                "📊 Download Excel",
+                data=excel_file,
+                file_name=f"{file_stem}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+        if json_file:
+            st.download_button(
+                "📄 Download JSON",
+                data=json_file,
+                file_name=f"{file_stem}.json",
+                mime="application/json"
+            )
 
 # Footer
 st.markdown("---")